@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+'''
+Purpose:
+Streaming statistics for the knife cycle times. The two running averages (cycles per minute by
+operation time and by shift time) hide slow cycles, micro stops and jitter, so every cycle
+interval is also fed in here.
+
+For every window (minute, hour and shift) this keeps:
+- quantiles (p50, p90, p99) using a DDSketch. Every quantile is within 1% of the real value and
+  the sketch never has more than MAX_BINS buckets, so memory stays the same no matter how long the shift is
+- a histogram of cycle times with fixed bins (HISTOGRAM_EDGES)
+- an EWMA of the cycles per minute. It keeps dropping during a stop, so a stop shows up right away
+- how many outlier cycles there were
+
+A cycle is an outlier if it is more than OUTLIER_Z standard deviations away from the EWMA of the
+normal cycle times. This is checked as soon as the cycle happens. If OUTLIER_RUN outliers happen
+in a row the machine is running at a new speed, so that becomes the new normal.
+
+Running this file directly benchmarks the CPU cost per cycle:
+    python3 cycle_stats.py
+'''
+
+import math
+import time as t
+from bisect import bisect_right
+
+MINUTE = 60000
+HOUR = 60 * MINUTE
+SHIFT = 8 * HOUR
+
+RELATIVE_ACCURACY = 0.01 # quantiles are within 1% of the real value
+# max buckets per sketch. Enough to cover 1 ms to a whole shift at 1% (about 860 buckets) without merging any
+MAX_BINS = math.ceil(math.log(SHIFT) / math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))) + 1
+HISTOGRAM_EDGES = (250, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000, 30000, 60000) # cycle time bins in ms, last bin is everything above 60 s
+
+OUTLIER_Z = 4 # how many standard deviations away a cycle has to be to count as an outlier
+OUTLIER_ALPHA = 0.05 # how fast the normal cycle time adapts (bigger = faster)
+OUTLIER_WARMUP = 20 # cycles to see before anything is flagged
+OUTLIER_RUN = 10 # this many outliers in a row means the machine is running at a new speed
+OUTLIER_MIN_STD = 5 # ms. The standard deviation never goes below this...
+OUTLIER_MIN_SHARE = 0.02 # ...or this share of the normal cycle time, so identical cycles don't make every 1 ms difference an outlier
+
+
+class DDSketch():
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY, max_bins=MAX_BINS):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.reset()
+
+    def reset(self):
+        self.bins = {} #bucket index -> count
+        self.zero_count = 0 #values that are 0 (two cycles in the same millisecond)
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+
+        if value <= 0:
+            self.zero_count += 1
+            return
+
+        key = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+
+        if len(self.bins) > self.max_bins:
+            #Merges the two lowest buckets. This only loses accuracy on the very fastest cycles
+            lowest = min(self.bins)
+            lowestCount = self.bins.pop(lowest)
+            nextLowest = min(self.bins)
+            self.bins[nextLowest] += lowestCount
+
+    def quantile(self, q): # returns the value at quantile q (0 to 1), or 0 if nothing has been added
+        if self.count == 0:
+            return 0
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1) #middle of the bucket
+
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+class Histogram():
+
+    def __init__(self, edges=HISTOGRAM_EDGES):
+        self.edges = edges
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def add(self, value):
+        self.counts[bisect_right(self.edges, value)] += 1
+
+class Window():
+    '''Statistics of the cycle times over one period (a minute, an hour or a shift).
+    tau is the time constant of the EWMA rate in ms, normally the length of the window.'''
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.sketch = DDSketch()
+        self.histogram = Histogram()
+        self.rate = 0 #EWMA of cycles per minute. Kept when the window is reset so it stays smooth
+        self.last = None #timestamp of the last cycle, used to keep lowering the rate during a stop
+        self.reset()
+
+    def reset(self):
+        self.sketch.reset()
+        self.histogram.reset()
+        self.count = 0
+        self.total = 0
+        self.total_squares = 0
+        self.max = 0
+        self.outliers = 0
+
+    def add(self, timestamp, interval, outlier):
+        self.last = timestamp
+        self.sketch.add(interval)
+        self.histogram.add(interval)
+        self.count += 1
+        self.total += interval
+        self.total_squares += interval * interval
+        self.max = max(self.max, interval)
+        if outlier:
+            self.outliers += 1
+
+        #Time weighted EWMA: a long gap moves the rate more than a short one
+        if interval > 0:
+            weight = 1 - math.exp(-interval / self.tau)
+            self.rate += weight * (MINUTE / interval - self.rate)
+
+    def jitter(self): # standard deviation of the cycle times in ms
+        if self.count < 2:
+            return 0
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_squares / self.count - mean * mean, 0))
+
+    def current_rate(self, now=None): # EWMA rate at time now (ms). The time since the last cycle counts as a cycle rate of 0
+        if now is None or self.last is None or now <= self.last:
+            return self.rate
+        return self.rate * math.exp(-(now - self.last) / self.tau)
+
+    def summary(self, now=None, precision=2):
+        return {
+            "count": self.count,
+            "p50": round(self.sketch.quantile(0.5), precision),
+            "p90": round(self.sketch.quantile(0.9), precision),
+            "p99": round(self.sketch.quantile(0.99), precision),
+            "max": self.max,
+            "jitter": round(self.jitter(), precision),
+            "outliers": self.outliers,
+            "cpm": round(self.current_rate(now), precision),
+            "histogram": list(self.histogram.counts),
+        }
+
+class CycleStats():
+    '''Takes the timestamp (ms) of every knife cycle and keeps per minute, per hour and per shift statistics.
+    The minute and hour windows are reset by whoever owns this object (log_data() in data_handler.py).'''
+
+    def __init__(self):
+        self.minute = Window(MINUTE)
+        self.hour = Window(HOUR)
+        self.shift = Window(SHIFT)
+        self.reset_shift()
+
+    def reset_shift(self):
+        self.minute.reset()
+        self.hour.reset()
+        self.shift.reset()
+        self.last = None #timestamp of the last cycle
+        self.mean = 0 #EWMA of the normal cycle time
+        self.var = 0 #EWMA of the variance of the normal cycle time
+        self.seen = 0
+        self.run = [] #intervals of the outliers in a row
+
+    def add(self, timestamp): # adds one cycle. Returns the interval in ms if it was an outlier, otherwise None
+
+        if self.last is None: #first cycle of the shift has nothing to compare to
+            self.last = timestamp
+            return None
+
+        interval = timestamp - self.last
+        self.last = timestamp
+
+        outlier = self.is_outlier(interval)
+
+        self.minute.add(timestamp, interval, outlier)
+        self.hour.add(timestamp, interval, outlier)
+        self.shift.add(timestamp, interval, outlier)
+
+        return interval if outlier else None
+
+    def is_outlier(self, interval):
+
+        self.seen += 1
+        if self.seen == 1:
+            self.mean = interval
+            return False
+
+        diff = interval - self.mean
+        minStd = max(OUTLIER_MIN_STD, OUTLIER_MIN_SHARE * self.mean)
+        var = max(self.var, minStd * minStd)
+        outlier = self.seen > OUTLIER_WARMUP and diff * diff > OUTLIER_Z * OUTLIER_Z * var
+
+        #Outliers are not used to update the normal cycle time, otherwise one long stop would hide the next ones
+        if not outlier:
+            self.run = []
+            self.mean += OUTLIER_ALPHA * diff
+            self.var = (1 - OUTLIER_ALPHA) * (self.var + OUTLIER_ALPHA * diff * diff)
+            return False
+
+        #A lot of outliers in a row means the speed changed, so the new speed becomes the normal cycle time
+        self.run.append(interval)
+        if len(self.run) >= OUTLIER_RUN:
+            self.mean = sum(self.run) / len(self.run)
+            self.var = sum((x - self.mean) ** 2 for x in self.run) / len(self.run)
+            self.run = []
+
+        return True
+
+
+#----------------------------------------------
+# Benchmark
+
+def benchmark(cycles=200000):
+    import random
+
+    rng = random.Random(0)
+    timestamps = []
+    now = 1562590800000 #7/8/2019 6:00 AM in milliseconds
+    for _ in range(cycles):
+        interval = rng.gauss(1000, 20)
+        if rng.random() < 0.002: #micro stops
+            interval += rng.expovariate(1 / 30000)
+        now += max(int(interval), 1)
+        timestamps.append(now)
+
+    stats = CycleStats()
+    outliers = 0
+
+    start = t.perf_counter()
+    for timestamp in timestamps:
+        if stats.add(timestamp) is not None:
+            outliers += 1
+    elapsed = t.perf_counter() - start
+
+    start = t.perf_counter()
+    for _ in range(100):
+        stats.shift.summary()
+    summary_time = (t.perf_counter() - start) / 100
+
+    print("Cycles:            " + str(cycles))
+    print("Per cycle:         %.2f us" % (elapsed / cycles * 1e6))
+    print("Summary:           %.2f us" % (summary_time * 1e6))
+    print("Sketch buckets:    " + str(len(stats.shift.sketch.bins)) + " (max " + str(MAX_BINS) + ")")
+    print("Outliers flagged:  " + str(outliers))
+    print("Shift summary:     " + str(stats.shift.summary()))
+
+if __name__ == "__main__":
+    benchmark()
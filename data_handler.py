@@ -11,11 +11,11 @@ then add the data into a .txt file. At the end of the day at exactly 2:01, the .
 The program will also send the data over to a webserver to desplay date in realtime. That will be implemented soon.
 
 TODO: 
-- If file does not upload, try again in 5 min
 - If disconnect, restart
 - 
 
 DONE:
+- Files that did not upload (no internet, ApiError, ...) are uploaded the next time with the rest of the backlog
 - Implement MQTT
 - make raspberry pi autoboot to script 
 - Make sure to add total_encoder_distance() in the f.write in log_data() again
@@ -28,10 +28,13 @@ DONE:
 
 #Standard Imports
 from datetime import datetime, timedelta, time
-from multiprocessing import Process, Value
+from multiprocessing import Process, Value, Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import time as t
 import os
 import sys
+import json
+import threading
 
 #3rd party imports
 import schedule
@@ -41,6 +44,8 @@ import credentials
 from dropbox.files import WriteMode
 from dropbox.exceptions import ApiError, AuthError
 import paho.mqtt.publish as publish
+import timestamp_codec
+import cycle_stats
 
 if os.name == 'nt':
     print("Not importing spidev and RPI.GPIO. These libraries only work on Rasp Pi")
@@ -78,16 +83,25 @@ if os.name == 'nt':
     pathdir = "C:\\Users\\Cameron\\Desktop\\" + machineID   #put the path on where you want to put the files
     errordir = pathdir + "\\error-log"              #error log directory
     sensorDatadir = pathdir + "\\sensor-readings"   #sensor readings directory
+    uploadStateFile = pathdir + "\\upload-state.json" #keeps track of which files have been uploaded to Dropbox
 
 else:
     # Linux/Raspberry pi directories
     pathdir = "/home/pi/Desktop/" + machineID           #put the path on where you want to put the files
     errordir = pathdir + "/error-log"               #error log directory
     sensorDatadir = pathdir + "/sensor-readings"    #sensor readings directory
+    uploadStateFile = pathdir + "/upload-state.json" #keeps track of which files have been uploaded to Dropbox
 
 # Global variables for logging to file
 detected = False #state of the laser sensor detection
 count = Value('i', 0) #count of the laser sensor
+cycleTimes = Queue() #timestamps (ms) of every knife cycle, filled by the laser process and read by watch_cycles()
+cycleBuffer = [] #timestamps waiting to be picked up by log_data()
+cycleFileToCompact = None #.cyc file written to this shift. Rewritten into full blocks at the end of the shift
+cycleStats = cycle_stats.CycleStats() #per minute, per hour and per shift cycle time statistics
+hourStatsHour = datetime.now().hour #hour the hour statistics started in
+headerCheckedFile = None #sensor readings file that has already been checked for an old header
+statsLock = threading.Lock() #cycleBuffer and cycleStats are used by both watch_cycles() and the scheduled functions
 encoder = 0 #set to 0 until instance is made
 lastEncoderCount = 0 # Temporary encoder value to calculate the last encoder count
 totalShiftTime = 0 #total shift time is set to 0
@@ -98,6 +112,19 @@ operationTimeTime = timedelta(minutes=0) #Same as above but for operation time..
 downTime = 0 #yeah...
 state = "OFF"
 
+# Dropbox upload variables
+dbx = None #Dropbox client, made once by get_dropbox() and reused for every upload
+UPLOAD_WORKERS = 4 #how many files are uploaded at the same time
+
+# Header of the sensor readings file. Has to have the same columns as the rows written in log_data()
+LOG_HEADER = ("Date,Time,Total Cycle Count,Cycles Per Minute By Operation Time,"
+             "Cycles Per Minute By Shift Time,Encoder Count (ft),Down Time,"
+             "Operation Time (shift time-downtime),Shift time,"
+             "Total Shift Time (minutes),Total Operation Time (minutes),"
+             "Cycle Time p50 (ms),Cycle Time p90 (ms),Cycle Time p99 (ms),Max Cycle Time (ms),"
+             "Cycle Time Jitter (ms),Outlier Cycles,EWMA Cycles Per Minute,Cycle Time Histogram,"
+             "Shift Cycle Time p50 (ms),Shift Cycle Time p99 (ms),Shift Outlier Cycles\n")
+
 # Pin variables, both on GPIO not "Board" config
 ORANGE_LED_PIN = 20
 GREEN_LED_PIN = 21 
@@ -237,7 +264,7 @@ def setup():
     print("Ready!")
 
 #Reads the laser sensor
-def read_laser(c):
+def read_laser(c, q):
 
     global detected, LASER_PIN
 
@@ -247,6 +274,7 @@ def read_laser(c):
         if((sensorVal == 0) and (detected == False)):
             #print("High")
             c.value += 1
+            q.put(int(t.time() * 1000)) #timestamp of the cycle in milliseconds
             #print(c.value) #prints the count of the knife
             detected = True
             
@@ -295,9 +323,73 @@ def log_error(): # This function is to log an error to a file. This is usually c
     print(traceback.format_exc() + "\n\n")
 
 
+def watch_cycles(): #Runs on its own thread. Takes every cycle from the laser process as it happens and updates the statistics
+
+    while True:
+        timestamp = cycleTimes.get() #waits for the next cycle
+
+        with statsLock:
+            cycleBuffer.append(timestamp)
+            outlier = cycleStats.add(timestamp)
+
+        if outlier is not None:
+            print("Outlier cycle: " + str(outlier) + " ms at " + str(datetime.fromtimestamp(timestamp / 1000)))
+
+def get_cycle_times(): #Takes all the cycle timestamps collected since the last call
+
+    global cycleBuffer
+
+    with statsLock:
+        times = cycleBuffer
+        cycleBuffer = []
+    return times
+
+def compact_cycle_file(): #End of the shift. Rewrites the .cyc file from small per-minute blocks into full blocks, which compress a lot better
+
+    global cycleFileToCompact
+
+    if cycleFileToCompact is None:
+        return
+
+    try:
+        timestamp_codec.compact_file(cycleFileToCompact)
+        print("Cycle timestamp file has been compacted")
+    except FileNotFoundError:
+        pass
+    except:
+        log_error()
+
+    cycleFileToCompact = None
+
+def get_cycle_summaries(): #Returns the minute, hour and shift summaries and starts a new minute (and a new hour when the hour changes)
+
+    global hourStatsHour
+
+    now = int(t.time() * 1000) #so the cycles per minute drop during a stop instead of staying at the last value
+
+    with statsLock:
+        minute = cycleStats.minute.summary(now)
+        hour = cycleStats.hour.summary(now)
+        shift = cycleStats.shift.summary(now)
+
+        cycleStats.minute.reset()
+        if datetime.now().hour != hourStatsHour: #checks the hour instead of minute == 0 in case this runs late
+            cycleStats.hour.reset()
+            hourStatsHour = datetime.now().hour
+
+    return minute, hour, shift
+
+def header_changed(filename): #True if the last header or row in the file has a different number of columns than LOG_HEADER
+    with open(filename, 'r') as f:
+        lines = f.read().splitlines()
+
+    if not lines:
+        return False
+    return lines[-1].count(',') != LOG_HEADER.count(',')
+
 def log_data(): #Logs the necessary data to the file
 
-    global downTimeState, lastEncoderCount, totalShiftTime, totalOperationTime, shiftTimeTime, operationTimeTime, downTime, state, uid
+    global downTimeState, lastEncoderCount, totalShiftTime, totalOperationTime, shiftTimeTime, operationTimeTime, downTime, state, uid, cycleFileToCompact, headerCheckedFile
 
     print(datetime.now()) # Not necessary. Just wanted to include this to help debug
 
@@ -318,6 +410,10 @@ def log_data(): #Logs the necessary data to the file
 
     CPM_BY_SHIFT = cpm_by_shift_time()
 
+    cycle_times = get_cycle_times() #always emptied so the buffer doesn't grow when not logging
+
+    minute_stats, hour_stats, shift_stats = get_cycle_summaries()
+
     try:
         if check_in_interval(time(6, 00), time(14, 00), datetime.now().time()) and is_working_day(): #Only logs the data between 6:00 AM - 2:00 PM
 
@@ -342,25 +438,35 @@ def log_data(): #Logs the necessary data to the file
                 #Linux/Raspberry pi
                 filename = sensorDatadir + "/" + str(datetime.now().strftime("%m-%d-%y")) + ".txt" 
 
+            #A file started by an older version has fewer columns, so the header is written again before the new rows
+            header_needed = filename != headerCheckedFile and os.path.exists(filename) and header_changed(filename)
+            headerCheckedFile = filename
+
             with open(filename, 'a') as f:
                 
-                if os.stat(filename).st_size == 0:
+                if os.stat(filename).st_size == 0 or header_needed:
                     #Prints the headers for the file
-                    f.write("Date,Time,Total Cycle Count,Cycles Per Minute By Operation Time,"
-                            "Cycles Per Minute By Shift Time,Encoder Count (ft),Down Time,"
-                            "Operation Time (shift time-downtime),Shift time,"
-                            "Total Shift Time (minutes),Total Operation Time (minutes)\n") 
+                    f.write(LOG_HEADER) 
 
                 #This is how data will be logged to .txt file
                 f.write(nowdate + ',' + nowtime + ',' + str(knife_count) + ',' + str(round(CPM_BY_OPERATION, precision)) + ',' 
                         + str(round(CPM_BY_SHIFT, precision)) + ',' + str(round(total_encoder_distance, precision)) + ',' + str(timedelta(minutes = downTime)) + ','
                         + str(operationTimeTime) + ',' + str(shiftTimeTime) + ',' + str(totalShiftTime) + ','
-                        + str(totalOperationTime) + '\n') #line that writes to file. MAKE SURE YOU PUT total_encoder_distance() again!!
+                        + str(totalOperationTime) + ',' + str(minute_stats["p50"]) + ',' + str(minute_stats["p90"]) + ','
+                        + str(minute_stats["p99"]) + ',' + str(minute_stats["max"]) + ',' + str(minute_stats["jitter"]) + ','
+                        + str(minute_stats["outliers"]) + ',' + str(minute_stats["cpm"]) + ','
+                        + ';'.join(str(x) for x in minute_stats["histogram"]) + ',' #histogram counts are split by ; so they stay in one column
+                        + str(shift_stats["p50"]) + ',' + str(shift_stats["p99"]) + ',' + str(shift_stats["outliers"]) + '\n') #line that writes to file. MAKE SURE YOU PUT total_encoder_distance() again!!
 
                 f.close
 
                 print("Data has been logged!")
 
+                #Per-cycle timestamps go in a separate compressed file next to the .txt file
+                cycleFilename = filename[:-len(".txt")] + ".cyc"
+                timestamp_codec.append_to_file(cycleFilename, cycle_times) #written every minute so a power cut only loses the last minute
+                cycleFileToCompact = cycleFilename
+
                 totalShiftTime += 1 #increments total shift time by 1 because being logged by every 1 minute
                 shiftTimeTime += timedelta(minutes=1) #increments total shift time by 1 minute. This is the actual time variable!!
 
@@ -380,13 +486,17 @@ def log_data(): #Logs the necessary data to the file
 
         else:
             print("Time was not in interval or is not in workingDay so data was not logged")
+            compact_cycle_file() #end of the shift, before the file gets uploaded
             GPIO.output(ORANGE_LED_PIN, GPIO.LOW) #turns off Orange LED to signify that the logging is not in progress
             state = "OFF"
 
         #This is to format the data being sent over MQTT
         data = (str(uid)+"$"+state+"$"+str(datetime.now())+"$"+str(knife_count)+"$"+str(round(CPM_BY_OPERATION, precision))+
                 "$"+str(round(CPM_BY_SHIFT, precision))+"$"+str(round(total_encoder_distance, precision))+"$"+str(downTime)+
-                "$"+str(totalShiftTime)+"$"+str(totalOperationTime))
+                "$"+str(totalShiftTime)+"$"+str(totalOperationTime)+
+                "$"+str(minute_stats["p50"])+"$"+str(minute_stats["p99"])+"$"+str(minute_stats["jitter"])+"$"+str(minute_stats["outliers"])+
+                "$"+str(hour_stats["p50"])+"$"+str(hour_stats["p99"])+"$"+str(hour_stats["outliers"])+
+                "$"+str(shift_stats["p50"])+"$"+str(shift_stats["p99"])+"$"+str(shift_stats["outliers"])+"$"+str(minute_stats["cpm"]))
         try:
             publish.single(topicRoot, data, hostname=BROKER)
             print("Data has been sent via MQTT")
@@ -401,44 +511,45 @@ def delete_files(): #function that deletes the oldest files in on the system
     days = 365 #The amount of days/files to keep on the system. Files are made by the day.
 
     try:
-        #Deletes old sensor-data files
-        while len([name for name in os.listdir(sensorDatadir)]) > days: #Keep the most recent days files. Can be changed by changing the "days" variable
-            list_of_files = os.listdir(sensorDatadir)
+        uploaded = load_upload_state()
 
-            #Windows
-            if os.name == 'nt':
-                full_path = [sensorDatadir + "\\{0}".format(x) for x in list_of_files]
-
-            #Linux/Raspberry pi
-            else:
-                full_path = [sensorDatadir + "/{0}".format(x) for x in list_of_files]
-
-            oldest_file = min(full_path, key=os.path.getctime)
-            os.remove(oldest_file) #Deletes the oldest files
+        #Deletes old sensor-data files. There is a .txt and a .cyc file for every day so they are counted separately
+        for ext in (".txt", ".cyc"):
+            remove_oldest_files(sensorDatadir, ext, days, uploaded)
 
         print("Old sensor files have been removed")
 
         #Deletes old error-log files
-        while len([name for name in os.listdir(errordir)]) > days: #Keep the most recent days files. Can be changed by changing the "days" variable
-            list_of_files = os.listdir(errordir)
-
-            #Windows
-            if os.name == 'nt':
-                full_path = [errordir + "\\{0}".format(x) for x in list_of_files]
-
-            #Linux/Raspberry pi
-            else:
-                full_path = [errordir + "/{0}".format(x) for x in list_of_files]
-
-            
-            oldest_file = min(full_path, key=os.path.getctime)
-            os.remove(oldest_file) #Deletes the oldest files
+        remove_oldest_files(errordir, ".txt", days, uploaded)
 
         print("Old error-log files have been removed")
 
+        save_upload_state(uploaded)
+
     except:
         log_error()
 
+def remove_oldest_files(directory, ext, days, uploaded): #Deletes the oldest files until only "days" files are left. Files that are not on Dropbox yet are never deleted
+
+    list_of_files = [name for name in os.listdir(directory) if name.endswith(ext)]
+
+    #Windows
+    if os.name == 'nt':
+        full_path = [directory + "\\{0}".format(x) for x in list_of_files]
+
+    #Linux/Raspberry pi
+    else:
+        full_path = [directory + "/{0}".format(x) for x in list_of_files]
+
+    full_path.sort(key=os.path.getctime) #oldest first
+
+    for oldest_file in full_path[:max(len(full_path) - days, 0)]: #Keep the most recent days files. Can be changed by changing the "days" variable
+        if is_uploaded(oldest_file, uploaded):
+            os.remove(oldest_file) #Deletes the oldest files
+            uploaded.pop(oldest_file, None)
+        else:
+            print("Not deleting " + oldest_file + " because it has not been uploaded to Dropbox yet")
+
 def reset_values():  #Function for resetting the values back to 0
 
     if is_working_day():  #Not really necessary but I just wanted to add it
@@ -460,6 +571,10 @@ def reset_values():  #Function for resetting the values back to 0
         operationTimeTime = timedelta(minutes=0) #resets actual operation time
         downTime = 0 #resets actual down time time
 
+        with statsLock:
+            cycleStats.reset_shift() #cycle time statistics start again for the new shift
+        print("Cycle time statistics have been reset")
+
     else:
         print("Not a working day so values were not reset. Doesn't matter because they will be reset before next shift.")
 
@@ -495,99 +610,189 @@ def cpm_by_shift_time(): #cycles per minute by shift time
         log_error()
         return "ERROR" #returns "ERROR" and logs it to file if there is an error 
 
-def upload_files_to_dropbox():
+def get_dropbox(): #Returns the Dropbox client. It is only made once so the same login and HTTP connections are reused for every upload
 
-    if is_working_day(): #checks if the current day is within the workingDay tuple. If is_working_day returns True then it will perform what is below.
+    global dbx
 
-        #Local paths on system to upload to Dropbox (Windows)
-        if os.name == 'nt':
-            localFile = sensorDatadir + "\\" + str(datetime.now().strftime("%m-%d-%y")) + '.txt'
-            errorFile = errordir + "\\errorlog " + str(datetime.now().strftime("%m-%d-%y")) + ".txt"
+    if dbx is None:
+        print("Creating a Dropbox object...")
+        session = dropbox.create_session(max_connections=UPLOAD_WORKERS) #one connection per upload worker
+        client = dropbox.Dropbox(TOKEN, max_retries_on_error=4, session=session)
 
-        #Local paths on system to upload to Dropbox (Linux/raspberry pi)
-        else:
-            localFile = sensorDatadir + "/" + str(datetime.now().strftime("%m-%d-%y")) + ".txt"
-            errorFile = errordir + "/errorlog " + str(datetime.now().strftime("%m-%d-%y")) + ".txt" 
+        # Check that the access token is valid
+        try:
+            client.users_get_current_account()
 
-        #Paths on Dropbox to upload the LOCALFILE and errorFile variables
-        backupPath = '/' + machineID + '/sensor-readings/' + str(datetime.now().strftime("%m-%d-%y")) + '.txt' 
-        errorPath = '/' + machineID + '/error-log/error ' + str(datetime.now().strftime("%m-%d-%y")) + '.txt'
+        except AuthError:
+            sys.exit("ERROR: Invalid access token; try re-generating an "
+                     "access token from the app console on the web.")
 
-        try:
-            print("Creating a Dropbox object...")
-            dbx = dropbox.Dropbox(TOKEN, max_retries_on_error=4)
-        
-            # Check that the access token is valid
-            try:
-                dbx.users_get_current_account()
+        dbx = client
 
-            except AuthError:
-                sys.exit("ERROR: Invalid access token; try re-generating an "
-                         "access token from the app console on the web.")
+    return dbx
 
-            except ApiError:
-                print("ApiError, check code...")
+def load_upload_state(): #Reads which files have been uploaded. Returns {local path: [size, modified time]} of the files when they were uploaded
+    try:
+        with open(uploadStateFile, 'r') as f:
+            return json.load(f)
 
-            except:
-                print("Error getting users account. Make sure device is connected to the internet.")
+    except FileNotFoundError:
+        return {}
 
-            try:
-                with open(localFile, 'rb') as f:
-                    # We use WriteMode=overwrite to make sure that the settings in the file
-                    # are changed on upload
-                    print("Uploading " + localFile + " to Dropbox as " + backupPath + "...")
-                    try:
-                        dbx.files_upload(f.read(), backupPath, mode=WriteMode('add'))
-                        print("Sensor readings upload were successful!")
-
-                    except ApiError as err:
-                        # This checks for the specific error where a user doesn't have
-                        # enough Dropbox space quota to upload this file
-
-                        if (err.error.is_path() and
-                                err.error.get_path().reason.is_insufficient_space()):
-                            sys.exit("ERROR: Cannot back up; insufficient space.")
-
-                        elif err.user_message_text:
-                            print(err.user_message_text)
-                            sys.exit()
-
-                        else:
-                            print("Error: File most likely already exists therefore didn't upload. This was the error:\n\n" + err)
-
-            except FileNotFoundError:
-                print("ERROR: Sensor data file could not be found!")
-                
-            try:
-                with open(errorFile, 'rb') as f:
-                # We use WriteMode=overwrite to make sure that the settings in the file
-                # are changed on upload
-                    print("Uploading " + errorFile + " to Dropbox as " + errorPath + "...")
-                    try:
-                        dbx.files_upload(f.read(), errorPath, mode=WriteMode('add'))
-                        print("Error log upload was successful!")
-
-                        delete_files() #deletes old files if the upload was successful
-
-                    except ApiError as err:
-                        # This checks for the specific error where a user doesn't have
-                        # enough Dropbox space quota to upload this file
-                        if (err.error.is_path() and
-                                err.error.get_path().reason.is_insufficient_space()):
-                            sys.exit("ERROR: Cannot back up; insufficient space.")
-
-                        elif err.user_message_text:
-                            print(err.user_message_text)
-                            sys.exit()
-
-                        else:
-                            print("Error: File most likely already exists therefore didn't upload. This was the error:\n\n" + err)
-
-            except FileNotFoundError:
-                print("ERROR: Error log file could not be found!")
-        
-        except:
-            print("An error occured while trying to upload files. Connection may have been lost. Check internet connection.")
+    except ValueError:
+        print("Upload state file is corrupt. Every file will be uploaded again")
+        return {}
+
+def save_upload_state(uploaded):
+    tempFile = uploadStateFile + ".tmp"
+    with open(tempFile, 'w') as f:
+        json.dump(uploaded, f)
+    os.replace(tempFile, uploadStateFile) #replace in one step so a power cut can't leave half a file
+
+def file_signature(localFile): #size and modified time of a file. If either changes the file has to be uploaded again
+    stat = os.stat(localFile)
+    return [stat.st_size, stat.st_mtime]
+
+def is_uploaded(localFile, uploaded):
+    return uploaded.get(localFile) == file_signature(localFile)
+
+def list_dropbox_folder(folder): #Returns {lowercase Dropbox path: size} of the files in a Dropbox folder
+
+    sizes = {}
+
+    try:
+        result = get_dropbox().files_list_folder(folder)
+
+    except ApiError as err:
+        if err.error.is_path() and err.error.get_path().is_not_found(): #nothing has been uploaded to this folder yet
+            return sizes
+        raise
+
+    while True:
+        for entry in result.entries:
+            if isinstance(entry, dropbox.files.FileMetadata):
+                sizes[entry.path_lower] = entry.size
+
+        if not result.has_more:
+            return sizes
+        result = get_dropbox().files_list_folder_continue(result.cursor)
+
+def seed_upload_state(): #First start with the upload queue. Marks the local files that are already on Dropbox (same name and size) as uploaded
+
+    remote = {}
+    for folder in ("sensor-readings", "error-log"):
+        remote.update(list_dropbox_folder('/' + machineID + '/' + folder))
+
+    uploaded = {}
+    for localFile, dropboxPath in get_upload_backlog({}):
+        signature = file_signature(localFile)
+        if remote.get(dropboxPath.lower()) == signature[0]:
+            uploaded[localFile] = signature
+
+    save_upload_state(uploaded)
+    print(str(len(uploaded)) + " existing file(s) are already on Dropbox")
+
+def get_upload_backlog(uploaded): #Returns a list of (local path, Dropbox path) for every file that still needs to be uploaded
+
+    backlog = []
+
+    for directory, folder in ((sensorDatadir, "sensor-readings"), (errordir, "error-log")):
+        if not os.path.exists(directory):
+            continue
+
+        for name in sorted(os.listdir(directory)):
+            #Windows
+            if os.name == 'nt':
+                localFile = directory + "\\" + name
+
+            #Linux/Raspberry pi
+            else:
+                localFile = directory + "/" + name
+
+            if not os.path.isfile(localFile) or name.endswith(".tmp") or is_uploaded(localFile, uploaded): #.tmp is a half finished compact_file()
+                continue
+
+            # Error logs are named "errorlog 07-08-19.txt" locally but "error 07-08-19.txt" on Dropbox
+            if folder == "error-log":
+                name = name.replace("errorlog ", "error ", 1)
+
+            backlog.append((localFile, '/' + machineID + '/' + folder + '/' + name))
+
+    return backlog
+
+def upload_file(localFile, dropboxPath): #Uploads one file. Returns the signature of the file that was uploaded
+
+    signature = file_signature(localFile) #taken before reading so a write during the upload makes it upload again next time
+
+    with open(localFile, 'rb') as f:
+        # We use WriteMode=overwrite so files that were changed after their last upload
+        # (e.g. an error log that got appended to) replace the old copy
+        print("Uploading " + localFile + " to Dropbox as " + dropboxPath + "...")
+        get_dropbox().files_upload(f.read(), dropboxPath, mode=WriteMode('overwrite'))
+
+    return signature
+
+def upload_files_to_dropbox(): #Uploads every file that hasn't been uploaded yet, not just today's
+
+    try:
+        if not os.path.exists(uploadStateFile):
+            seed_upload_state() #only saved if Dropbox could be listed, otherwise it is tried again next time
+
+        uploaded = {f: sig for f, sig in load_upload_state().items() if os.path.exists(f)} #forgets files that are gone
+        backlog = get_upload_backlog(uploaded)
+
+        if not backlog:
+            print("All files are already on Dropbox")
+            delete_files() #retention still has to run on days with nothing to upload
+            return
+
+        print(str(len(backlog)) + " file(s) to upload to Dropbox")
+        get_dropbox() #log in before starting the workers so they don't all try to at once
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            futures = {executor.submit(upload_file, localFile, dropboxPath): localFile for localFile, dropboxPath in backlog}
+
+            for future in as_completed(futures):
+                localFile = futures[future]
+                try:
+                    uploaded[localFile] = future.result()
+                    print(localFile + " upload was successful!")
+
+                except ApiError as err:
+                    failed += 1
+                    # This checks for the specific error where a user doesn't have
+                    # enough Dropbox space quota to upload this file
+                    if (err.error.is_path() and
+                            err.error.get_path().reason.is_insufficient_space()):
+                        print("ERROR: Cannot back up " + localFile + "; insufficient space.")
+
+                    elif err.user_message_text:
+                        print(err.user_message_text)
+
+                    else:
+                        print("Error uploading " + localFile + ". It will be tried again next time. This was the error:\n\n" + str(err))
+
+                except FileNotFoundError:
+                    failed += 1
+                    print("ERROR: " + localFile + " could not be found!")
+
+                except Exception:
+                    failed += 1
+                    print("An error occured while uploading " + localFile + ". Connection may have been lost. It will be tried again next time.")
+
+        save_upload_state(uploaded)
+
+        if failed:
+            print(str(failed) + " file(s) did not upload and will be tried again next time")
+
+        delete_files() #deletes old files. Files that did not upload are kept
+
+    except SystemExit: #invalid access token
+        raise
+
+    except:
+        print("An error occured while trying to upload files. Connection may have been lost. Check internet connection.")
 
 #NOTE: The .every().day parts will execute everyday... but there are "if" statements within the functions that
 # actually determine if the rest of the function will be ran or not.
@@ -599,13 +804,15 @@ for minute in range(0, 60, STEP):
     time_t = ":{minute:02d}".format(minute=minute)
     schedule.every().hour.at(time_t).do(log_data)
     
-schedule.every().day.at('14:01').do(upload_files_to_dropbox) #upload file to Dropbox at 2:01 PM
+schedule.every().day.at('14:01').do(upload_files_to_dropbox) #upload file to Dropbox at 2:01 PM. Any files that didn't upload before are uploaded too
 
 def main():
     try:
         setup() #initial setup function. 
-        process_1 = Process(target=read_laser, args=(count,)) #This is a multiproccessing thread so the Rasp Pi will count the laser while it does everything else. 
+        process_1 = Process(target=read_laser, args=(count, cycleTimes)) #This is a multiproccessing thread so the Rasp Pi will count the laser while it does everything else. 
         process_1.start()
+        thread_1 = threading.Thread(target=watch_cycles, daemon=True) #Updates the cycle time statistics as soon as each cycle happens
+        thread_1.start()
         while True:
             schedule.run_pending() #This is needed for the schedule to work
             t.sleep(1)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+'''
+Purpose:
+Compact storage for the per-cycle timestamp streams. A shift produces millions of knife
+timestamps so writing them as text would fill up the SD card and take forever to upload.
+
+Timestamps (integers, milliseconds since epoch) are stored as delta-of-delta values packed
+into zigzag varints. Cycles are very regular so most values end up being 1 byte.
+
+The file is made of blocks that are appended one after another. Every block has a header:
+
+    magic (4 bytes) | sample count | first timestamp | last timestamp | payload length
+
+so a reader can skip over the payloads and jump straight to the blocks covering a time range.
+
+Every block has a 28 byte header, so small blocks compress a lot worse. data_handler.py appends a small
+block every minute (so a power cut only loses the last minute) and at the end of the shift compact_file()
+rewrites the day's file into full blocks of BLOCK_SIZE.
+
+Running this file directly runs a benchmark on made up cycle patterns:
+    python3 timestamp_codec.py
+
+"Ratio" is for full blocks (the file after compact_file(), which is what gets uploaded). "1 blk/min"
+is the ratio during the shift, while there is still one block per minute.
+'''
+
+import os
+import struct
+import time as t
+
+import numpy as np
+
+MAGIC = b'CYC1'
+HEADER = struct.Struct('<4sIqqI') # magic, count, first timestamp, last timestamp, payload length
+BLOCK_SIZE = 4096 # max samples per block. Smaller blocks = faster seeking, bigger blocks = less header overhead
+
+MAX_VARINT_BYTES = 10 # a 64 bit value needs at most 10 groups of 7 bits
+
+
+def zigzag_encode(values): # maps signed ints to unsigned so small negatives stay small (0,-1,1,-2 -> 0,1,2,3)
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+def zigzag_decode(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+def varint_encode(values): # packs unsigned ints into LEB128 varints (7 bits per byte, high bit = more bytes follow)
+    values = np.asarray(values, dtype=np.uint64)
+
+    if values.size == 0:
+        return b''
+
+    #Works out how many bytes each value needs
+    nbytes = np.ones(values.size, dtype=np.int64)
+    for k in range(1, MAX_VARINT_BYTES):
+        nbytes += (values >> np.uint64(7 * k)) != 0
+
+    ends = np.cumsum(nbytes)
+    starts = ends - nbytes
+    out = np.zeros(int(ends[-1]), dtype=np.uint8)
+
+    #Fills in byte k of every value that is at least k+1 bytes long
+    for k in range(int(nbytes.max())):
+        mask = nbytes > k
+        group = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = np.where(nbytes[mask] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[mask] + k] = (group | more).astype(np.uint8)
+
+    return out.tobytes()
+
+def varint_decode(data): # reverse of varint_encode. Returns a uint64 array
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    if data.size == 0:
+        return np.zeros(0, dtype=np.uint64)
+
+    ends = np.flatnonzero(data < 0x80) #last byte of each value has the high bit cleared
+    if ends.size == 0 or ends[-1] != data.size - 1:
+        raise ValueError("Truncated varint data")
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    lengths = ends - starts + 1
+    if lengths.max() > MAX_VARINT_BYTES:
+        raise ValueError("Varint is too long")
+
+    values = np.zeros(ends.size, dtype=np.uint64)
+    for k in range(int(lengths.max())):
+        mask = lengths > k
+        group = (data[starts[mask] + k] & 0x7f).astype(np.uint64)
+        values[mask] |= group << np.uint64(7 * k)
+
+    return values
+
+def encode_block(timestamps): # encodes one block (header + payload) of sorted timestamps
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    if timestamps.size == 0:
+        return b''
+
+    deltas = np.diff(timestamps)
+    dod = np.diff(deltas, prepend=0) #first value is the first delta, the rest are delta-of-delta
+    payload = varint_encode(zigzag_encode(dod))
+
+    header = HEADER.pack(MAGIC, timestamps.size, int(timestamps[0]), int(timestamps[-1]), len(payload))
+    return header + payload
+
+def decode_payload(first, count, payload): # turns a block payload back into timestamps
+    dod = zigzag_decode(varint_decode(payload))
+
+    if dod.size != count - 1:
+        raise ValueError("Block says it has %d samples but payload has %d" % (count, dod.size + 1))
+
+    timestamps = np.empty(count, dtype=np.int64)
+    timestamps[0] = first
+    np.cumsum(np.cumsum(dod), out=timestamps[1:])
+    timestamps[1:] += first
+    return timestamps
+
+def encode(timestamps, block_size=BLOCK_SIZE): # encodes any number of timestamps into one or more blocks
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    return b''.join(encode_block(timestamps[i:i + block_size]) for i in range(0, timestamps.size, block_size))
+
+def read_index(data): # returns a list of (first, last, count, payload offset, payload length) without decoding anything
+    index = []
+    offset = 0
+
+    while offset < len(data):
+        if len(data) - offset < HEADER.size:
+            raise ValueError("Truncated block header at byte %d" % offset)
+
+        magic, count, first, last, length = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError("Bad block header at byte %d" % offset)
+
+        offset += HEADER.size
+        if offset + length > len(data):
+            raise ValueError("Truncated block payload at byte %d" % offset)
+
+        index.append((first, last, count, offset, length))
+        offset += length
+
+    return index
+
+def decode(data, start=None, end=None): # decodes all timestamps, or only the ones between start and end (inclusive)
+    data = memoryview(data)
+    chunks = []
+
+    for first, last, count, offset, length in read_index(data):
+        #Skips blocks that are completely outside of the range
+        if (start is not None and last < start) or (end is not None and first > end):
+            continue
+        chunks.append(decode_payload(first, count, data[offset:offset + length]))
+
+    if not chunks:
+        return np.zeros(0, dtype=np.int64)
+
+    timestamps = np.concatenate(chunks)
+    if start is not None:
+        timestamps = timestamps[timestamps >= start]
+    if end is not None:
+        timestamps = timestamps[timestamps <= end]
+    return timestamps
+
+def append_to_file(filename, timestamps): # appends timestamps to a block file. Each call adds new block(s)
+    data = encode(timestamps)
+    if data:
+        with open(filename, 'ab') as f:
+            f.write(data)
+    return len(data)
+
+def read_file(filename, start=None, end=None):
+    with open(filename, 'rb') as f:
+        return decode(f.read(), start, end)
+
+def compact_file(filename): # rewrites a block file into full BLOCK_SIZE blocks. Returns the new size
+    data = encode(read_file(filename))
+
+    tempFile = filename + ".tmp"
+    with open(tempFile, 'wb') as f:
+        f.write(data)
+    os.replace(tempFile, filename) #replace in one step so a power cut can't leave half a file
+    return len(data)
+
+
+#----------------------------------------------
+# Benchmark
+
+def make_cycle_pattern(seconds, cpm=60, jitter_ms=15, seed=0): # makes realistic looking knife timestamps
+    rng = np.random.default_rng(seed)
+    period = 60000 / cpm
+    n = int(seconds * 1000 / period)
+
+    intervals = period + rng.normal(0, jitter_ms, n) #normal cycles with a bit of jitter
+
+    #Every so often the machine stops for a bit (micro stops and longer down time)
+    stops = rng.random(n) < 0.002
+    intervals[stops] += rng.exponential(60000, stops.sum())
+
+    start = 1562590800000 #7/8/2019 6:00 AM in milliseconds
+    return start + np.cumsum(np.maximum(intervals, 1)).astype(np.int64)
+
+def encode_per_minute(timestamps): # encodes one block per minute of timestamps
+    minutes = timestamps // 60000
+    starts = np.flatnonzero(np.diff(minutes, prepend=minutes[0] - 1))
+    return b''.join(encode_block(chunk) for chunk in np.split(timestamps, starts[1:]))
+
+def benchmark(repeat=5):
+    patterns = [
+        ("slow 10 cpm, 8 hours", make_cycle_pattern(8 * 3600, cpm=10, jitter_ms=50)),
+        ("steady 60 cpm, 8 hours", make_cycle_pattern(8 * 3600, cpm=60, jitter_ms=5)),
+        ("jittery 120 cpm, 8 hours", make_cycle_pattern(8 * 3600, cpm=120, jitter_ms=40)),
+        ("fast 600 cpm, 8 hours", make_cycle_pattern(8 * 3600, cpm=600, jitter_ms=10)),
+    ]
+
+    print("%-26s %10s %10s %10s %8s %10s %12s %12s" % ("Pattern", "Samples", "Text (B)", "Coded (B)", "Ratio", "1 blk/min",
+          "Enc (MB/s)", "Dec (MB/s)"))
+
+    for name, timestamps in patterns:
+        text_size = len(''.join(str(x) + '\n' for x in timestamps.tolist()))
+        raw_mb = timestamps.nbytes / 1e6 #throughput is measured against the raw int64 size
+
+        start = t.perf_counter()
+        for _ in range(repeat):
+            data = encode(timestamps)
+        enc_time = (t.perf_counter() - start) / repeat
+
+        start = t.perf_counter()
+        for _ in range(repeat):
+            decoded = decode(data)
+        dec_time = (t.perf_counter() - start) / repeat
+
+        if not np.array_equal(decoded, timestamps):
+            raise AssertionError("Round trip failed for " + name)
+
+        per_minute = len(encode_per_minute(timestamps))
+
+        print("%-26s %10d %10d %10d %7.1fx %9.1fx %12.1f %12.1f" % (name, timestamps.size, text_size, len(data),
+              text_size / len(data), text_size / per_minute, raw_mb / enc_time, raw_mb / dec_time))
+
+if __name__ == "__main__":
+    benchmark()